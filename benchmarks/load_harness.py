@@ -0,0 +1,404 @@
+"""Load/save latency harness for YFCStd.
+
+Instantiates many YFCStd documents in one process and drives concurrent
+collaborators against them from an asyncio event loop, the way the Jupyter
+server does: each collaborator repeatedly edits objects through Y.js, asks
+for the document sources (``get``) or reloads it (``set``).
+
+Since ``get`` returns the last saved sources right away, the harness also
+measures how long an edit takes to be saved by FreeCAD, and how late a probe
+task sleeping on the event loop wakes up, which shows any work blocking the
+loop.
+
+Run with the deterministic FreeCAD stand-in of the tests::
+
+    python benchmarks/load_harness.py --fake --documents 20 --collaborators 4
+
+or against real FreeCAD with an FCStd file::
+
+    python benchmarks/load_harness.py --file examples/common.FCStd
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+# Metadata key stamping each edit, to find out which edits a save includes
+EDIT_STAMP = "LoadHarnessEdit"
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# The FreeCAD stand-in shared with the tests, imported without the package
+FAKE_FREECAD_DIR = os.path.join(HERE, os.pardir, "jupytercad_freecad", "tests")
+
+
+class SaveTracker:
+    """Measures the time between an edit and the end of the first FreeCAD
+    save including it.
+
+    Each edit stamps the document metadata with the document key and an
+    increasing sequence number, which FCStd.save receives along with the
+    edited objects.
+    """
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        # Edit times by sequence number, by document key
+        self._pending: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    @property
+    def unsaved(self) -> int:
+        """The number of edits that were not saved yet"""
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def install(self) -> None:
+        """Wraps FCStd.save to find out when the edits get saved"""
+        from jupytercad_freecad.freecad.loader import FCStd
+
+        save = FCStd.save
+        tracker = self
+
+        def tracked_save(fc_file, objects, options, metadata):
+            report = save(fc_file, objects, options, metadata)
+            stamp = metadata.get(EDIT_STAMP)
+            if stamp and not report.fatal:
+                tracker._saved(stamp)
+            return report
+
+        FCStd.save = tracked_save
+
+    def edited(self, doc, key: str) -> None:
+        from pycrdt import Map
+
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._pending[key][seq] = time.perf_counter()
+        doc.ydoc.get("metadata", type=Map)[EDIT_STAMP] = f"{key}:{seq}"
+
+    def reloaded(self, key: str) -> None:
+        """Forgets the edits discarded by reloading a document"""
+        with self._lock:
+            self._pending[key].clear()
+
+    def _saved(self, stamp: str) -> None:
+        now = time.perf_counter()
+        key, seq = stamp.rsplit(":", 1)
+        with self._lock:
+            pending = self._pending[key]
+            for edit in [edit for edit in pending if edit <= int(seq)]:
+                self.latencies.append(now - pending.pop(edit))
+
+
+async def _probe_loop_lag(
+    interval: float, lags: List[float], stop: asyncio.Event
+) -> None:
+    """Records how late the event loop wakes up a task sleeping ``interval``"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[idx]
+
+
+def _rss() -> int:
+    """Returns the resident set size of the process in bytes.
+
+    Unlike tracemalloc, this accounts for the memory allocated by FreeCAD's
+    C++ code. Where ``/proc`` is not available, the peak resident set size
+    is returned instead.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _stats(values: List[float]) -> Dict:
+    return dict(
+        count=len(values),
+        p50=_percentile(values, 50),
+        p95=_percentile(values, 95),
+        p99=_percentile(values, 99),
+    )
+
+
+def _edit(doc, rng: random.Random) -> None:
+    """Changes a numeric parameter of a random object, like a collaborator would"""
+    n_objects = len(doc.objects)
+    if not n_objects:
+        return
+    obj = doc.objects[rng.randrange(n_objects)]
+    parameters = dict(obj["parameters"])
+    numeric = [
+        k
+        for k, v in parameters.items()
+        if isinstance(v, (int, float)) and not isinstance(v, bool)
+    ]
+    if numeric:
+        key = rng.choice(numeric)
+        parameters[key] = max(0.5, parameters[key] + rng.choice((-0.5, 0.5)))
+        obj["parameters"] = parameters
+    else:
+        obj["visible"] = not obj["visible"]
+
+
+async def _collaborator(
+    doc,
+    key: str,
+    content: str,
+    args,
+    rng: random.Random,
+    latencies: Dict[str, List[float]],
+    tracker: SaveTracker,
+) -> None:
+    deadline = time.perf_counter() + args.duration
+    while time.perf_counter() < deadline:
+        roll = rng.random()
+        if roll < args.set_ratio:
+            op = "set"
+        elif roll < args.set_ratio + args.get_ratio:
+            op = "get"
+        else:
+            op = "edit"
+
+        start = time.perf_counter()
+        if op == "set":
+            doc.set(content)
+        elif op == "get":
+            doc.get()
+        else:
+            _edit(doc, rng)
+        latencies[op].append(time.perf_counter() - start)
+
+        if op == "set":
+            tracker.reloaded(key)
+        elif op == "edit":
+            tracker.edited(doc, key)
+
+        await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+
+async def _run(args, content: str) -> Dict:
+    from jupytercad_freecad.fcstd_ydoc import YFCStd
+
+    kwargs = {}
+    if args.debounce is not None:
+        kwargs["save_debounce"] = args.debounce
+
+    tracker = SaveTracker()
+    tracker.install()
+
+    tracemalloc.start()
+    mem_start = tracemalloc.get_traced_memory()[0]
+    rss_start = _rss()
+
+    docs = []
+    open_latencies = []
+    for _ in range(args.documents):
+        doc = YFCStd(**kwargs)
+        start = time.perf_counter()
+        doc.set(content)
+        open_latencies.append(time.perf_counter() - start)
+        docs.append(doc)
+    mem_opened = tracemalloc.get_traced_memory()[0]
+    rss_opened = _rss()
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    latencies["open"] = open_latencies
+    rng = random.Random(args.seed)
+    lags: List[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe_loop_lag(args.lag_interval, lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            _collaborator(
+                doc,
+                str(idx),
+                content,
+                args,
+                random.Random(rng.random()),
+                latencies,
+                tracker,
+            )
+            for idx, doc in enumerate(docs)
+            for _ in range(args.collaborators)
+        )
+    )
+    stop.set()
+    await probe
+    # Edits still waiting for a save when the collaborators stop
+    unsaved = tracker.unsaved
+    # Let the deferred saves complete
+    for doc in docs:
+        doc.flush()
+    elapsed = time.perf_counter() - start
+
+    mem_end, mem_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_end = _rss()
+
+    n_ops = sum(len(v) for k, v in latencies.items() if k != "open")
+    return dict(
+        documents=args.documents,
+        collaborators=args.collaborators,
+        elapsed=elapsed,
+        throughput=n_ops / elapsed,
+        saves=sum(doc.save_count for doc in docs),
+        latency={op: _stats(values) for op, values in sorted(latencies.items())},
+        saved=dict(_stats(tracker.latencies), unsaved=unsaved),
+        loop_lag=dict(_stats(lags), max=max(lags, default=float("nan"))),
+        memory=dict(
+            after_open=mem_opened - mem_start,
+            growth=mem_end - mem_opened,
+            peak=mem_peak - mem_start,
+        ),
+        rss=dict(
+            after_open=rss_opened - rss_start,
+            growth=rss_end - rss_opened,
+            end=rss_end,
+        ),
+    )
+
+
+def _print_results(results: Dict) -> None:
+    print(
+        f"{results['documents']} documents x {results['collaborators']} "
+        f"collaborators, {results['elapsed']:.2f}s"
+    )
+    print(f"{'op':<6} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = dict(results["latency"], saved=results["saved"], lag=results["loop_lag"])
+    for op, stats in rows.items():
+        print(
+            f"{op:<6} {stats['count']:>7} {stats['p50'] * 1e3:>9.2f} "
+            f"{stats['p95'] * 1e3:>9.2f} {stats['p99'] * 1e3:>9.2f}"
+        )
+    print(
+        "saved: from an edit to the end of the FreeCAD save including it, "
+        f"{results['saved']['unsaved']} edit(s) left unsaved"
+    )
+    print(
+        "lag: event loop wake-up delay, "
+        f"{results['loop_lag']['max'] * 1e3:.2f} ms max"
+    )
+    print(f"throughput: {results['throughput']:.1f} ops/s")
+    print(f"FreeCAD saves: {results['saves']}")
+    memory = results["memory"]
+    print(
+        f"memory: {memory['after_open'] / 2**20:.1f} MB after open, "
+        f"{memory['growth'] / 2**20:+.1f} MB during the run, "
+        f"{memory['peak'] / 2**20:.1f} MB peak"
+    )
+    rss = results["rss"]
+    print(
+        f"RSS: {rss['after_open'] / 2**20:+.1f} MB after open, "
+        f"{rss['growth'] / 2**20:+.1f} MB during the run, "
+        f"{rss['end'] / 2**20:.1f} MB at the end"
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="FCStd file to load with real FreeCAD")
+    source.add_argument(
+        "--fake", action="store_true", help="Use the deterministic FreeCAD stand-in"
+    )
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--collaborators", type=int, default=3, help="Per document")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds")
+    parser.add_argument(
+        "--think-time", type=float, default=0.05, help="Mean pause between ops"
+    )
+    parser.add_argument("--get-ratio", type=float, default=0.3)
+    parser.add_argument("--set-ratio", type=float, default=0.02)
+    parser.add_argument("--debounce", type=float, default=None)
+    parser.add_argument(
+        "--lag-interval",
+        type=float,
+        default=0.01,
+        help="Sleep of the event loop lag probe, in seconds",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--snapshot-cache",
+        action="store_true",
+        help="Use a temporary snapshot cache instead of disabling it",
+    )
+    fake = parser.add_argument_group("FreeCAD stand-in")
+    fake.add_argument("--objects", type=int, default=50, help="Objects per file")
+    fake.add_argument("--open-cost", type=float, default=0.02)
+    fake.add_argument("--recompute-cost", type=float, default=0.01)
+    fake.add_argument("--per-object-cost", type=float, default=0.0002)
+    fake.add_argument(
+        "--spin", action="store_true", help="Hold the GIL instead of sleeping"
+    )
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    # The snapshot cache is configured before jupytercad_freecad is imported
+    snapshot_dir = tempfile.mkdtemp() if args.snapshot_cache else ""
+    os.environ["JUPYTERCAD_FREECAD_SNAPSHOT_DIR"] = snapshot_dir
+    try:
+        return _main(args)
+    finally:
+        if snapshot_dir:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+def _main(args) -> int:
+    if args.fake:
+        sys.path.insert(0, FAKE_FREECAD_DIR)
+        import fake_freecad
+
+        fake_freecad.costs.open = args.open_cost
+        fake_freecad.costs.recompute = args.recompute_cost
+        fake_freecad.costs.open_per_object = args.per_object_cost
+        fake_freecad.costs.recompute_per_object = args.per_object_cost
+        fake_freecad.costs.spin = args.spin
+        fake_freecad.install()
+        raw = fake_freecad.make_document(args.objects, args.seed)
+    else:
+        with open(args.file, "rb") as f:
+            raw = f.read()
+    content = base64.b64encode(raw).decode()
+
+    results = asyncio.run(_run(args, content))
+    _print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,39 +1,185 @@
-from typing import Any, Callable
+import asyncio
+import logging
+import time
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Optional
 from functools import partial
 
 from pycrdt import Array, Map, Text
 from jupyter_ydoc.ybasedoc import YBaseDoc
 
-from .freecad.loader import FCStd
+from .freecad.loader import (
+    ConversionReport,
+    FCStd,
+    freecad_lock,
+    get_freecad_executor,
+)
+from .freecad.snapshot import get_default_cache
+
+logger = logging.getLogger(__file__)
 
 
 class YFCStd(YBaseDoc):
-    def __init__(self, *args, **kwargs):
+    # Seconds after a FreeCAD save during which further saves are coalesced
+    save_debounce = 0.5
+
+    def __init__(self, *args, save_debounce: Optional[float] = None, **kwargs):
         super().__init__(*args, **kwargs)
         self._ydoc["source"] = self._ysource = Text()
         self._ydoc["objects"] = self._yobjects = Array()
         self._ydoc["options"] = self._yoptions = Map()
         self._ydoc["metadata"] = self._ymetadata = Map()
-        self._virtual_file = FCStd()
+        self._virtual_file = FCStd(snapshot_cache=get_default_cache())
+
+        if save_debounce is not None:
+            self.save_debounce = save_debounce
+        # The scheduling state below is only used from the event loop thread,
+        # the saves themselves run on the FreeCAD worker thread
+        self._pending = None
+        self._saved_snapshot = None
+        self._last_save = float("-inf")
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._saving: Optional[Future] = None
+        self._saving_snapshot = None
+        # Bumped by set(), saves started before it are discarded
+        self._generation = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._save_count = 0
 
     @property
     def objects(self) -> Array:
         return self._yobjects
 
+    @property
+    def save_count(self) -> int:
+        """The number of successful FreeCAD saves of the document"""
+        return self._save_count
+
     def version(self) -> str:
         return "0.1.0"
 
     def get(self):
-        fc_objects = self._yobjects.to_py()
-        options = self._yoptions.to_py()
-        meta = self._ymetadata.to_py()
+        """Returns the last saved FCStd sources of the document.
 
-        self._virtual_file.save(fc_objects, options, meta)
+        This never waits for FreeCAD: a change is saved in the background on
+        the FreeCAD worker thread, at most once every ``save_debounce``
+        seconds, and the document is marked dirty once the save completes so
+        that the latest sources get picked up. Without a running event loop,
+        the change is saved right away.
+        """
+        snapshot = self._snapshot()
+        if snapshot == self._saved_snapshot or (
+            self._saving is not None and snapshot == self._saving_snapshot
+        ):
+            self._pending = None
+            return self._virtual_file.sources
+
+        self._pending = snapshot
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.flush()
+        self._schedule()
+        return self._virtual_file.sources
+
+    def flush(self) -> str:
+        """Runs any deferred save right away and returns the up to date sources"""
+        if self._saving is not None:
+            wait([self._saving])
+            self._complete(self._saving)
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        snapshot, self._pending = self._pending, None
+        if snapshot is not None:
+            with freecad_lock:
+                report = self._save(snapshot)
+            self._saved(snapshot, report)
         return self._virtual_file.sources
 
+    def _snapshot(self):
+        return (
+            self._yobjects.to_py(),
+            self._yoptions.to_py(),
+            self._ymetadata.to_py(),
+        )
+
+    def _schedule(self) -> None:
+        if self._handle is not None or self._saving is not None:
+            return
+        delay = max(0, self._last_save + self.save_debounce - time.monotonic())
+        self._handle = self._loop.call_later(delay, self._start_save)
+
+    def _start_save(self) -> None:
+        self._handle = None
+        snapshot, self._pending = self._pending, None
+        if snapshot is None:
+            return
+        self._saving_snapshot = snapshot
+        self._saving = get_freecad_executor().submit(
+            self._save_job, snapshot, self._generation
+        )
+        self._saving.add_done_callback(self._on_save_done)
+
+    def _save_job(self, snapshot, generation: int) -> Optional[ConversionReport]:
+        with freecad_lock:
+            # The document was reloaded while the save was queued
+            if generation != self._generation:
+                return None
+            return self._save(snapshot)
+
+    def _save(self, snapshot) -> ConversionReport:
+        fc_objects, options, meta = snapshot
+        return self._virtual_file.save(fc_objects, options, meta)
+
+    def _on_save_done(self, future: Future) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._complete, future)
+        except RuntimeError:
+            # The loop was closed in the meantime
+            pass
+
+    def _complete(self, future: Future) -> None:
+        if future is not self._saving:
+            return
+        self._saving = None
+        snapshot, self._saving_snapshot = self._saving_snapshot, None
+        try:
+            report = future.result()
+        except Exception:
+            logger.exception("Failed to save the FreeCAD document")
+            report = None
+        if report is not None and self._saved(snapshot, report):
+            # Let the server know that newer sources are available
+            self.dirty = True
+        if self._pending is not None and self._loop is not None:
+            self._schedule()
+
+    def _saved(self, snapshot, report: Optional[ConversionReport]) -> bool:
+        """Records the outcome of a save, only successful saves count as such"""
+        self._last_save = time.monotonic()
+        if report is None or report.fatal:
+            logger.warning("The FreeCAD document was not saved, it will be retried")
+            return False
+        self._saved_snapshot = snapshot
+        self._save_count += 1
+        return True
+
     def set(self, value):
-        virtual_file = self._virtual_file
-        virtual_file.load(value)
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._pending = None
+        self._saving = self._saving_snapshot = None
+        self._generation += 1
+
+        # Waits for a save that already started, a queued one is discarded
+        with freecad_lock:
+            virtual_file = self._virtual_file
+            virtual_file.load(value)
         objects = []
 
         for obj in virtual_file.objects:
@@ -47,6 +193,8 @@ class YFCStd(YBaseDoc):
         self._ymetadata.clear()
         self._ymetadata.update(virtual_file.metadata)
 
+        self._saved_snapshot = self._snapshot()
+
     def observe(self, callback: Callable[[str, Any], None]):
         self.unobserve()
         self._subscriptions[self._ystate] = self._ystate.observe(
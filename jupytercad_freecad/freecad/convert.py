@@ -0,0 +1,306 @@
+"""Headless batch conversion of FCStd files into jcad documents.
+
+Usage::
+
+    jupytercad-freecad-convert SOURCE_DIR OUTPUT_DIR [--jobs N] [--sidecar brep]
+        [--root NAME ...] [--type TYPEID ...]
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from .loader import FCStd, fc
+from .props import prop_handlers
+from .tools import redirect_stdout_stderr
+
+MANIFEST_NAME = ".jcad-manifest.json"
+# Number of converted files between two writes of the manifest
+MANIFEST_SAVE_INTERVAL = 50
+SIDECAR_FORMATS = ("brep", "stl")
+
+
+def _file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _find_fcstd_files(source_dir: str) -> List[str]:
+    """Returns the FCStd files of a directory tree, relative to its root"""
+    found = []
+    for root, _, files in os.walk(source_dir):
+        for name in files:
+            if name.lower().endswith(".fcstd"):
+                found.append(os.path.relpath(os.path.join(root, name), source_dir))
+    return sorted(found)
+
+
+def _write_sidecars(objects: List[Dict], prefix: str, sidecar: str) -> None:
+    """Writes one sidecar file per object carrying a shape"""
+    if sidecar == "stl":
+        with redirect_stdout_stderr():
+            import Part
+
+    for obj in objects:
+        brep = obj["parameters"].get("Shape")
+        if not brep:
+            continue
+        path = f"{prefix}.{obj['name']}.{sidecar}"
+        if sidecar == "brep":
+            with open(path, "w") as f:
+                f.write(brep)
+        else:
+            shape = Part.Shape()
+            shape.importBrepFromString(brep)
+            shape.exportStl(path)
+
+
+def _convert_file(
+    source: str,
+    destination: str,
+    sidecar: Optional[str],
+    roots: Optional[List[str]] = None,
+    types: Optional[List[str]] = None,
+) -> Tuple[int, int, Optional[str], Counter]:
+    """Converts one FCStd file.
+
+    Returns:
+        Tuple[int, int, Optional[str], Counter]: The number of converted
+        objects, the number of objects or properties that failed, the error
+        that aborted the conversion if any, and the number of properties
+        of each type that have no handler.
+    """
+    unhandled_before = prop_handlers.unhandled_counts()
+    try:
+        with open(source, "rb") as f:
+            content = base64.b64encode(f.read()).decode()
+
+        fc_file = FCStd()
+        type_filter = set(types).__contains__ if types else None
+        report = fc_file.load(content, roots=roots, type_filter=type_filter)
+
+        jcad = {
+            "objects": fc_file.objects,
+            "options": fc_file.options,
+            "metadata": fc_file.metadata,
+            "outputs": {},
+        }
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination, "w") as f:
+            json.dump(jcad, f)
+
+        if sidecar:
+            _write_sidecars(fc_file.objects, os.path.splitext(destination)[0], sidecar)
+
+        unhandled = prop_handlers.unhandled_counts() - unhandled_before
+        return len(fc_file.objects), len(report), None, unhandled
+    except Exception as e:
+        return 0, 0, f"{type(e).__name__}: {e}", Counter()
+
+
+def _load_manifest(output_dir: str) -> Dict[str, Dict]:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(output_dir: str, manifest: Dict[str, Dict]) -> None:
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _convert_all(todo: List[Tuple], jobs: Optional[int], *args):
+    """Yields ``(item, result)`` as the files of ``todo`` get converted.
+
+    A worker crash (e.g. a FreeCAD segfault) breaks the whole pool, so the
+    files that were lost with it are retried in a fresh pool. If a round
+    does not convert anything, the remaining files are converted one pool
+    per file so that a crashing file only fails itself.
+    """
+    remaining = todo
+    isolate = False
+    while remaining:
+        crashed = []
+        progressed = False
+        batches = [[item] for item in remaining] if isolate else [remaining]
+        for batch in batches:
+            with ProcessPoolExecutor(max_workers=1 if isolate else jobs) as executor:
+                futures = {
+                    executor.submit(_convert_file, item[1], item[2], *args): item
+                    for item in batch
+                }
+                for future in as_completed(futures):
+                    item = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        if not isolate:
+                            crashed.append(item)
+                            continue
+                        result = (0, 0, "the worker process crashed", Counter())
+                    except Exception as e:
+                        result = (0, 0, f"{type(e).__name__}: {e}", Counter())
+                    progressed = True
+                    yield item, result
+        remaining = crashed
+        isolate = not progressed
+
+
+def convert_tree(
+    source_dir: str,
+    output_dir: str,
+    jobs: Optional[int] = None,
+    sidecar: Optional[str] = None,
+    force: bool = False,
+    roots: Optional[List[str]] = None,
+    types: Optional[List[str]] = None,
+    out=sys.stdout,
+) -> int:
+    """Converts every FCStd file of ``source_dir`` into ``output_dir``.
+
+    Files whose content hash did not change since the last conversion are
+    skipped. Progress is streamed to ``out`` as files complete. ``roots``
+    and ``types`` restrict the conversion to the given object names or
+    ``TypeId`` values, and the objects they depend on.
+
+    Returns:
+        int: The number of files that failed to convert.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = _load_manifest(output_dir)
+
+    todo = []
+    skipped = 0
+    for rel_path in _find_fcstd_files(source_dir):
+        source = os.path.join(source_dir, rel_path)
+        destination = os.path.join(output_dir, os.path.splitext(rel_path)[0] + ".jcad")
+        entry = {
+            "sha256": _file_hash(source),
+            "sidecar": sidecar,
+            "roots": sorted(roots) if roots else None,
+            "types": sorted(types) if types else None,
+        }
+        if (
+            not force
+            and manifest.get(rel_path) == entry
+            and os.path.exists(destination)
+        ):
+            skipped += 1
+            continue
+        todo.append((rel_path, source, destination, entry))
+
+    print(f"{len(todo)} file(s) to convert, {skipped} up to date", file=out, flush=True)
+
+    failed = 0
+    done_bytes = 0
+    unhandled = Counter()
+    start = time.perf_counter()
+    try:
+        results = _convert_all(todo, jobs, sidecar, roots, types)
+        for idx, (item, result) in enumerate(results, start=1):
+            rel_path, source, _, entry = item
+            n_objects, n_errors, error, file_unhandled = result
+            unhandled.update(file_unhandled)
+            done_bytes += os.path.getsize(source)
+            if error is None:
+                manifest[rel_path] = entry
+                status = f"ok ({n_objects} objects, {n_errors} errors)"
+            else:
+                failed += 1
+                manifest.pop(rel_path, None)
+                status = f"FAILED {error}"
+            print(f"[{idx}/{len(todo)}] {rel_path}: {status}", file=out, flush=True)
+            if idx % MANIFEST_SAVE_INTERVAL == 0:
+                _save_manifest(output_dir, manifest)
+    finally:
+        # Keep the completed conversions even if the run is interrupted
+        _save_manifest(output_dir, manifest)
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(
+        f"Converted {len(todo) - failed}/{len(todo)} file(s) in {elapsed:.2f}s "
+        f"({len(todo) / elapsed:.2f} files/s, "
+        f"{done_bytes / elapsed / (1 << 20):.2f} MB/s)",
+        file=out,
+        flush=True,
+    )
+    if unhandled:
+        print("Most frequent property types without handler:", file=out)
+        for prop_type, count in unhandled.most_common(10):
+            print(f"  {prop_type}: {count}", file=out)
+    return failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="jupytercad-freecad-convert",
+        description="Convert a directory tree of FCStd files into jcad files.",
+    )
+    parser.add_argument("source", help="Directory containing the FCStd files")
+    parser.add_argument("output", help="Directory receiving the jcad files")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (defaults to the number of CPUs)",
+    )
+    parser.add_argument(
+        "--sidecar",
+        choices=SIDECAR_FORMATS,
+        default=None,
+        help="Also write each object's shape next to the jcad file",
+    )
+    parser.add_argument(
+        "--root",
+        dest="roots",
+        action="append",
+        metavar="NAME",
+        help="Only convert this object and its dependencies (repeatable)",
+    )
+    parser.add_argument(
+        "--type",
+        dest="types",
+        action="append",
+        metavar="TYPEID",
+        help="Only convert objects of this TypeId and their dependencies (repeatable)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Convert files even if they did not change since the last run",
+    )
+    args = parser.parse_args(argv)
+
+    if not fc:
+        parser.error("FreeCAD is not installed")
+
+    failed = convert_tree(
+        args.source,
+        args.output,
+        jobs=args.jobs,
+        sidecar=args.sidecar,
+        force=args.force,
+        roots=args.roots,
+        types=args.types,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
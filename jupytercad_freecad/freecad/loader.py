@@ -1,16 +1,22 @@
 import base64
+import hashlib
 import logging
 import os
 import tempfile
-import traceback
-from typing import Dict, List, Type
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from typing import Callable, Dict, Iterable, List, Optional, Set
 
-from .tools import redirect_stdout_stderr
+from .tools import RateLimitFilter, redirect_stdout_stderr
 
 from . import props as Props
-from .props.base_prop import BaseProp
+from .props.geometry import geom_handlers
+from .snapshot import SnapshotCache
 
 logger = logging.getLogger(__file__)
+logger.addFilter(RateLimitFilter())
 
 with redirect_stdout_stderr():
     try:
@@ -34,6 +40,57 @@ def _hex_to_rgb(hex_color):
     return tuple(int(hex_color[i : i + 2], 16) / 255.0 for i in (0, 2, 4))
 
 
+# Parsed GuiDocument.xml contents, keyed by the sha256 of the FCStd archive
+_GUIDATA_CACHE_SIZE = 32
+_guidata_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_guidata_cache_lock = threading.Lock()
+
+
+def _get_cached_guidata(content_hash: str) -> Optional[Dict]:
+    with _guidata_cache_lock:
+        guidata = _guidata_cache.get(content_hash)
+        if guidata is None:
+            return None
+        _guidata_cache.move_to_end(content_hash)
+    return deepcopy(guidata)
+
+
+def _set_cached_guidata(content_hash: str, guidata: Dict) -> None:
+    with _guidata_cache_lock:
+        _guidata_cache[content_hash] = deepcopy(guidata)
+        _guidata_cache.move_to_end(content_hash)
+        while len(_guidata_cache) > _GUIDATA_CACHE_SIZE:
+            _guidata_cache.popitem(last=False)
+
+
+def _select_objects(
+    fc_objects: List,
+    roots: Optional[Iterable[str]] = None,
+    type_filter: Optional[Callable[[str], bool]] = None,
+) -> List:
+    """Returns the objects matching ``roots`` or ``type_filter``, along with
+    everything they depend on, in document order.
+
+    Dependencies are read from FreeCAD's ``OutList``, which covers every kind
+    of link property (``App::PropertyLinkSub`` for a Pad profile included)
+    as well as expressions.
+    """
+    roots = set(roots or ())
+    selected: Set[str] = set()
+    stack = [
+        obj
+        for obj in fc_objects
+        if obj.Name in roots or (type_filter is not None and type_filter(obj.TypeId))
+    ]
+    while stack:
+        obj = stack.pop()
+        if obj.Name in selected:
+            continue
+        selected.add(obj.Name)
+        stack.extend(obj.OutList)
+    return [obj for obj in fc_objects if obj.Name in selected]
+
+
 def _guidata_to_options(guidata):
     """Converts freecad guidata into options that JupyterCad understands"""
     options = {}
@@ -61,37 +118,107 @@ def _guidata_to_options(guidata):
     return options
 
 
+def _obj_options_to_guidata(data):
+    """Converts the JupyterCad options of a single object into freecad guidata"""
+    obj_data = {}
+
+    # Handle color property from JupyterCad to FreeCAD's ShapeColor
+    if "color" in data:
+        rgb_value = _hex_to_rgb(data["color"])
+        obj_data["ShapeColor"] = dict(type="App::PropertyColor", value=rgb_value)
+
+    # Handle visibility property from JupyterCad to FreeCAD's Visibility
+    if "visible" in data:
+        obj_data["Visibility"] = dict(type="App::PropertyBool", value=data["visible"])
+
+    return obj_data
+
+
 def _options_to_guidata(options):
     """Converts JupyterCad options into freecad guidata"""
     gui_data = {}
 
     for obj_name, data in options.items():
-        obj_data = {}
-
         # We need to make a special case to "GuiCameraSettings" because freecad's
         # OfflineRenderingUtils mixes the camera settings with 3D objects
         if obj_name == "GuiCameraSettings":
             gui_data[obj_name] = data
             continue
 
-        # Handle color property from JupyterCad to FreeCAD's ShapeColor
-        if "color" in data:
-            rgb_value = _hex_to_rgb(data["color"])
-            obj_data["ShapeColor"] = dict(type="App::PropertyColor", value=rgb_value)
+        gui_data[obj_name] = _obj_options_to_guidata(data)
+
+    return gui_data
 
-        # Handle visibility property from JupyterCad to FreeCAD's Visibility
-        if "visible" in data:
-            obj_data["Visibility"] = dict(
-                type="App::PropertyBool", value=data["visible"]
+
+# FreeCAD is not thread-safe, every call into it must hold this lock
+freecad_lock = threading.RLock()
+_freecad_executor: Optional[ThreadPoolExecutor] = None
+# Not freecad_lock, which the worker holds for whole loads and saves
+_freecad_executor_lock = threading.Lock()
+
+
+def get_freecad_executor() -> ThreadPoolExecutor:
+    """Returns the process-wide worker thread running FreeCAD work off the
+    event loop, without ever waiting for FreeCAD"""
+    global _freecad_executor
+    if _freecad_executor is None:
+        with _freecad_executor_lock:
+            if _freecad_executor is None:
+                _freecad_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="jupytercad-freecad"
+                )
+    return _freecad_executor
+
+
+MAX_REPORTED_ERRORS = 100
+
+
+class ConversionReport:
+    """Bounded record of the objects and properties that failed to convert"""
+
+    def __init__(self, max_errors: int = MAX_REPORTED_ERRORS) -> None:
+        self.max_errors = max_errors
+        self.errors: List[Dict] = []
+        # Number of errors that did not fit in the report
+        self.dropped = 0
+        # Whether the whole conversion failed, rather than some objects
+        self.fatal = False
+
+    def add(
+        self,
+        stage: str,
+        error: Exception,
+        obj_name: Optional[str] = None,
+        prop: Optional[str] = None,
+    ) -> None:
+        if len(self.errors) >= self.max_errors:
+            self.dropped += 1
+            return
+        self.errors.append(
+            dict(
+                stage=stage,
+                object=obj_name,
+                property=prop,
+                error=f"{type(error).__name__}: {error}",
             )
+        )
 
-        gui_data[obj_name] = obj_data
+    def to_dict(self) -> Dict:
+        return dict(errors=list(self.errors), dropped=self.dropped)
 
-    return gui_data
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ConversionReport":
+        report = cls()
+        report.errors = list(data["errors"])
+        report.dropped = data["dropped"]
+        return report
+
+    def __len__(self) -> int:
+        return len(self.errors) + self.dropped
 
 
 class FCStd:
-    def __init__(self) -> None:
+    def __init__(self, snapshot_cache: Optional[SnapshotCache] = None) -> None:
         self._sources = ""
         self._objects = []
         self._options = {}
@@ -99,10 +226,16 @@ class FCStd:
         self._id = None
         self._visible = True
         self._guidata = {}
-        self._prop_handlers: Dict[str, Type[BaseProp]] = {}
-        for Cls in Props.__dict__.values():
-            if isinstance(Cls, type) and issubclass(Cls, BaseProp):
-                self._prop_handlers[Cls.name()] = Cls
+        # Raw freecad guidata, only patched for objects whose options changed
+        self._fc_guidata = {}
+        # Names of the objects exposed by the last load, None if all of them are
+        self._loaded_names: Optional[Set[str]] = None
+        self._report = ConversionReport()
+        # Converted documents are stored there and reused for fast reopening
+        self._snapshot_cache = snapshot_cache
+        self._prop_handlers = Props.prop_handlers
+        self._prop_handlers.load_entry_points()
+        geom_handlers.load_entry_points()
 
     @property
     def sources(self):
@@ -120,136 +253,323 @@ class FCStd:
     def options(self):
         return self._options
 
-    def load(self, base64_content: str) -> None:
+    @property
+    def report(self) -> ConversionReport:
+        """The errors collected by the last load or save"""
+        return self._report
+
+    def load(
+        self,
+        base64_content: str,
+        roots: Optional[Iterable[str]] = None,
+        type_filter: Optional[Callable[[str], bool]] = None,
+    ) -> ConversionReport:
+        """Loads a base64 encoded FCStd file.
+
+        Passing ``roots`` (object names) and/or ``type_filter`` (a predicate
+        on the object ``TypeId``) only loads the matching objects and the
+        objects they link to. The other objects are left untouched by
+        :meth:`save`, and so are the objects that failed to load.
+
+        Full loads are read from and stored to the snapshot cache, if any,
+        in which case FreeCAD is skipped entirely for known files.
+
+        Returns:
+            ConversionReport: The objects and properties that failed to load.
+        """
+        report = self._report = ConversionReport()
         if not fc:
-            return
+            return report
         self._sources = base64_content
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".FCStd") as tmp:
-            file_content = base64.b64decode(base64_content)
-            tmp.write(file_content)
-
-        fc_file = fc.app.openDocument(tmp.name)
-
-        # Get metadata
-        self._metadata = fc_file.Meta
-
-        # Get GuiData and assign it to the internal attribute
-        self._guidata = _guidata_to_options(OfflineRenderingUtils.getGuiData(tmp.name))
-
-        # Get objects
-        self._objects = []
-        for obj in fc_file.Objects:
-            obj_name = obj.Name
-
-            obj_data = self._fc_to_jcad_obj(obj)
-
-            if obj_name in self._guidata:
-                if "color" in self._guidata[obj_name]:
-                    default_color = "#808080"
-                    gui_data_color = self._guidata[obj_name]["color"]
-
-                    obj_data["parameters"]["Color"] = (
-                        gui_data_color if gui_data_color else default_color
-                    )
-                if "visible" in self._guidata[obj_name]:
-                    gui_data_visible = self._guidata[obj_name]["visible"]
-                    obj_data["visible"] = (
-                        gui_data_visible if gui_data_visible is not None else True
-                    )
-
-            self._objects.append(obj_data)
-
-        os.remove(tmp.name)
-
-    def save(self, objects: List, options: Dict, metadata: Dict) -> None:
-        try:
-            if not fc or len(self._sources) == 0:
-                return
+        file_content = base64.b64decode(base64_content)
+        content_hash = hashlib.sha256(file_content).hexdigest()
 
+        use_snapshot = (
+            self._snapshot_cache is not None and roots is None and type_filter is None
+        )
+        if use_snapshot:
+            snapshot = self._snapshot_cache.get(content_hash)
+            if snapshot is not None:
+                self._restore_snapshot(snapshot)
+                return self._report
+
+        # FreeCAD is not thread-safe
+        with freecad_lock:
             with tempfile.NamedTemporaryFile(delete=False, suffix=".FCStd") as tmp:
-                file_content = base64.b64decode(self._sources)
                 tmp.write(file_content)
-            fc_file = fc.app.openDocument(tmp.name)
-            fc_file.Meta = metadata
-            new_objs = dict([(o["name"], o) for o in objects])
-
-            current_objs = dict([(o.Name, o) for o in fc_file.Objects])
-
-            to_remove = [x for x in current_objs if x not in new_objs]
-            to_add = [x for x in new_objs if x not in current_objs]
-            for obj_name in to_remove:
-                fc_file.removeObject(obj_name)
-            for obj_name in to_add:
-                py_obj = new_objs[obj_name]
-                fc_file.addObject(py_obj["shape"], py_obj["name"])
-            to_update = [x for x in new_objs if x in current_objs] + to_add
-
-            for obj_name in to_update:
-                py_obj = new_objs[obj_name]
-                fc_obj = fc_file.getObject(py_obj["name"])
-
-                for prop, jcad_prop_value in py_obj["parameters"].items():
-                    if hasattr(fc_obj, prop):
-                        try:
-                            prop_type = fc_obj.getTypeIdOfProperty(prop)
-                            prop_handler = self._prop_handlers.get(prop_type, None)
-                            if prop_handler is not None:
-                                fc_value = prop_handler.jcad_to_fc(
-                                    jcad_prop_value,
-                                    jcad_object=objects,
-                                    fc_prop=getattr(fc_obj, prop),
-                                    fc_object=fc_obj,
-                                    fc_file=fc_file,
-                                )
-                                if fc_value:
-                                    setattr(fc_obj, prop, fc_value)
-                        except AttributeError as e:
-                            print(
-                                f"Error accessing property '{prop}' on object '{fc_obj.Name}': {e}"
-                            )
-                    else:
-                        print(
-                            f"Property '{prop}' does not exist on object '{fc_obj.Name}' and is not handled"
-                        )
 
-                # Handle updating the color in guidata
-                if "Color" in py_obj["parameters"]:
-                    new_hex_color = py_obj["parameters"]["Color"]
-                else:
-                    new_hex_color = "#808080"  # Default to gray if no color is provided
+            fc_file = None
+            try:
+                fc_file = fc.app.openDocument(tmp.name)
+
+                # Parse the GuiData, unless we already parsed that exact archive
+                guidata = _get_cached_guidata(content_hash)
+                if guidata is None:
+                    guidata = OfflineRenderingUtils.getGuiData(tmp.name)
+                    _set_cached_guidata(content_hash, guidata)
+
+                # Get metadata
+                self._metadata = fc_file.Meta
+
+                # Get GuiData and assign it to the internal attribute
+                self._fc_guidata = guidata
+                self._guidata = _guidata_to_options(guidata)
+
+                # Get objects
+                fc_objects = fc_file.Objects
+                partial = roots is not None or type_filter is not None
+                if partial:
+                    fc_objects = _select_objects(fc_objects, roots, type_filter)
+
+                self._objects = []
+                for obj in fc_objects:
+                    obj_name = obj.Name
+                    try:
+                        obj_data = self._fc_to_jcad_obj(obj, report)
+                    except Exception as e:
+                        partial = True
+                        report.add("load", e, obj_name)
+                        logger.warning("Failed to load object %s: %s", obj_name, e)
+                        continue
+
+                    if obj_name in self._guidata:
+                        if "color" in self._guidata[obj_name]:
+                            default_color = "#808080"
+                            gui_data_color = self._guidata[obj_name]["color"]
+
+                            obj_data["parameters"]["Color"] = (
+                                gui_data_color if gui_data_color else default_color
+                            )
+                        if "visible" in self._guidata[obj_name]:
+                            gui_data_visible = self._guidata[obj_name]["visible"]
+                            obj_data["visible"] = (
+                                gui_data_visible
+                                if gui_data_visible is not None
+                                else True
+                            )
 
-                if obj_name in self._guidata:
-                    self._guidata[obj_name]["color"] = new_hex_color
-                else:
-                    self._guidata[obj_name] = {"color": new_hex_color}
+                    self._objects.append(obj_data)
+
+                self._loaded_names = (
+                    {obj["name"] for obj in self._objects} if partial else None
+                )
+            finally:
+                if fc_file is not None:
+                    fc.app.closeDocument(fc_file.Name)
+                os.remove(tmp.name)
+
+        if use_snapshot:
+            self._snapshot_cache.put(content_hash, self._make_snapshot())
+        return report
+
+    def save(self, objects: List, options: Dict, metadata: Dict) -> ConversionReport:
+        """Applies the jcad objects and metadata to the FCStd sources.
+
+        A failure on one object or property is recorded and does not prevent
+        the rest of the document from being saved.
+
+        Returns:
+            ConversionReport: The objects and properties that failed to save.
+        """
+        report = self._report = ConversionReport()
+        if not fc or len(self._sources) == 0:
+            return report
+
+        # FreeCAD is not thread-safe
+        with freecad_lock:
+            tmp_name = None
+            fc_file = None
+            try:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=".FCStd") as tmp:
+                    tmp_name = tmp.name
+                    file_content = base64.b64decode(self._sources)
+                    tmp.write(file_content)
+                fc_file = fc.app.openDocument(tmp_name)
+                fc_file.Meta = metadata
+                new_objs = dict([(o["name"], o) for o in objects])
+
+                # The state is only updated once the document is saved
+                loaded_names = (
+                    set(self._loaded_names) if self._loaded_names is not None else None
+                )
+                guidata = deepcopy(self._guidata)
+                fc_guidata = deepcopy(self._fc_guidata)
+
+                current_objs = dict([(o.Name, o) for o in fc_file.Objects])
+
+                # Objects left out by a partial load are preserved as they are
+                to_remove = [
+                    x
+                    for x in current_objs
+                    if x not in new_objs and (loaded_names is None or x in loaded_names)
+                ]
+                to_add = []
+                for obj_name in to_remove:
+                    try:
+                        fc_file.removeObject(obj_name)
+                    except Exception as e:
+                        report.add("remove", e, obj_name)
+                        logger.warning("Failed to remove object %s: %s", obj_name, e)
+                clashing = set()
+                for obj_name in new_objs:
+                    if obj_name in current_objs:
+                        if loaded_names is None or obj_name in loaded_names:
+                            continue
+                        # Do not overwrite an object left out by a partial load
+                        clashing.add(obj_name)
+                        error = ValueError(
+                            f"{obj_name} clashes with an object that was not loaded"
+                        )
+                        report.add("add", error, obj_name)
+                        logger.warning("Failed to add object %s: %s", obj_name, error)
+                        continue
+                    py_obj = new_objs[obj_name]
+                    try:
+                        fc_file.addObject(py_obj["shape"], py_obj["name"])
+                    except Exception as e:
+                        report.add("add", e, obj_name)
+                        logger.warning("Failed to add object %s: %s", obj_name, e)
+                        continue
+                    to_add.append(obj_name)
+                if loaded_names is not None:
+                    loaded_names.difference_update(to_remove)
+                    loaded_names.update(to_add)
+                to_update = [
+                    x for x in new_objs if x in current_objs and x not in clashing
+                ] + to_add
+
+                for obj_name in to_update:
+                    try:
+                        self._update_fc_obj(
+                            new_objs[obj_name],
+                            objects,
+                            fc_file,
+                            guidata,
+                            fc_guidata,
+                            report,
+                        )
+                    except Exception as e:
+                        report.add("save", e, obj_name)
+                        logger.warning("Failed to save object %s: %s", obj_name, e)
+
+                OfflineRenderingUtils.save(fc_file, guidata=fc_guidata)
+
+                fc_file.recompute()
+                with open(tmp_name, "rb") as f:
+                    file_content = f.read()
+                self._sources = base64.b64encode(file_content).decode()
+                self._loaded_names = loaded_names
+                self._guidata = guidata
+                self._fc_guidata = fc_guidata
+            except Exception as e:
+                report.add("save", e)
+                report.fatal = True
+                logger.exception("Failed to save the FreeCAD document")
+            finally:
+                if fc_file is not None:
+                    fc.app.closeDocument(fc_file.Name)
+                if tmp_name is not None:
+                    os.remove(tmp_name)
+
+        return report
+
+    def _make_snapshot(self) -> Dict:
+        return dict(
+            objects=self._objects,
+            metadata=self._metadata,
+            guidata=self._fc_guidata,
+            loaded_names=(
+                sorted(self._loaded_names) if self._loaded_names is not None else None
+            ),
+            report=self._report.to_dict(),
+        )
 
-            OfflineRenderingUtils.save(
-                fc_file,
-                guidata=_options_to_guidata(self._guidata),
+    def _restore_snapshot(self, snapshot: Dict) -> None:
+        self._objects = snapshot["objects"]
+        self._metadata = snapshot["metadata"]
+        self._fc_guidata = snapshot["guidata"]
+        self._guidata = _guidata_to_options(self._fc_guidata)
+        loaded_names = snapshot["loaded_names"]
+        self._loaded_names = set(loaded_names) if loaded_names is not None else None
+        self._report = ConversionReport.from_dict(snapshot["report"])
+
+    def _update_fc_obj(
+        self,
+        py_obj: Dict,
+        objects: List,
+        fc_file,
+        guidata: Dict,
+        fc_guidata: Dict,
+        report: ConversionReport,
+    ) -> None:
+        obj_name = py_obj["name"]
+        fc_obj = fc_file.getObject(obj_name)
+
+        for prop, jcad_prop_value in py_obj["parameters"].items():
+            if not hasattr(fc_obj, prop):
+                logger.debug(
+                    "Property %s does not exist on object %s and is not handled",
+                    prop,
+                    obj_name,
+                )
+                continue
+            try:
+                prop_type = fc_obj.getTypeIdOfProperty(prop)
+                prop_handler = self._prop_handlers.get(prop_type, None)
+                if prop_handler is not None:
+                    fc_value = prop_handler.jcad_to_fc(
+                        jcad_prop_value,
+                        jcad_object=objects,
+                        fc_prop=getattr(fc_obj, prop),
+                        fc_object=fc_obj,
+                        fc_file=fc_file,
+                    )
+                    if fc_value:
+                        setattr(fc_obj, prop, fc_value)
+            except Exception as e:
+                report.add("save", e, obj_name, prop)
+                logger.warning(
+                    "Failed to save property %s of object %s: %s", prop, obj_name, e
+                )
+
+        # Handle updating the color and visibility in guidata
+        if "Color" in py_obj["parameters"]:
+            new_hex_color = py_obj["parameters"]["Color"]
+        else:
+            new_hex_color = "#808080"  # Default to gray if no color is provided
+        new_visible = py_obj.get("visible", True)
+
+        obj_options = guidata.setdefault(obj_name, {})
+        if (
+            obj_options.get("color") != new_hex_color
+            or obj_options.get("visible") != new_visible
+        ):
+            obj_options["color"] = new_hex_color
+            obj_options["visible"] = new_visible
+            fc_guidata.setdefault(obj_name, {}).update(
+                _obj_options_to_guidata(obj_options)
             )
 
-            fc_file.recompute()
-            with open(tmp.name, "rb") as f:
-                encoded = base64.b64encode(f.read())
-                self._sources = encoded.decode()
-            os.remove(tmp.name)
-        except Exception:
-            print(traceback.print_exc())
-
-    def _fc_to_jcad_obj(self, obj) -> Dict:
+    def _fc_to_jcad_obj(self, obj, report: ConversionReport) -> Dict:
+        plan = self._prop_handlers.dispatch(obj)
+        # Properties without handler are exposed as None without being read
+        parameters = dict.fromkeys(plan.properties)
         obj_data = dict(
             shape=obj.TypeId,
             visible=obj.Visibility,
-            parameters={},
+            parameters=parameters,
             name=obj.Name,
         )
-        for prop in obj.PropertiesList:
-            prop_type = obj.getTypeIdOfProperty(prop)
-            prop_value = getattr(obj, prop)
-            prop_handler = self._prop_handlers.get(prop_type, None)
-            if prop_handler is not None and prop_value is not None:
-                value = prop_handler.fc_to_jcad(prop_value, fc_object=obj)
-            else:
-                value = None
-            obj_data["parameters"][prop] = value
+        for prop, prop_handler in plan.handled:
+            try:
+                prop_value = getattr(obj, prop)
+                if prop_value is not None:
+                    parameters[prop] = prop_handler.fc_to_jcad(
+                        prop_value, fc_object=obj
+                    )
+            except Exception as e:
+                report.add("load", e, obj.Name, prop)
+                logger.warning(
+                    "Failed to load property %s of object %s: %s", prop, obj.Name, e
+                )
         return obj_data
@@ -8,3 +8,9 @@ from .property_link_list import *  # noqa
 from .property_map import *  # noqa
 from .property_partshape import *  # noqa
 from .property_placement import *  # noqa
+
+from .base_prop import BaseProp  # noqa
+from .registry import PropRegistry  # noqa
+
+prop_handlers = PropRegistry("jupytercad_freecad.props")
+prop_handlers.register_all(list(globals().values()))
@@ -3,6 +3,10 @@ from typing import Any
 
 
 class BaseProp(ABC):
+    # Bump when the output of the handler changes, this invalidates the
+    # data converted with previous versions
+    version = 1
+
     @staticmethod
     @abstractmethod
     def name() -> str:
@@ -0,0 +1,166 @@
+import hashlib
+import inspect
+import logging
+import threading
+from collections import Counter, OrderedDict
+from importlib.metadata import entry_points
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple, Type
+
+from .base_prop import BaseProp
+
+logger = logging.getLogger(__file__)
+
+# Number of conversion plans kept by a registry
+DISPATCH_CACHE_SIZE = 1024
+
+
+class Dispatch(NamedTuple):
+    """Precomputed conversion plan for a kind of FreeCAD object"""
+
+    # Names of all the properties, in the object order
+    properties: Tuple[str, ...]
+    # (property name, handler) of the properties that have a handler, the
+    # other properties are never read
+    handled: Tuple[Tuple[str, Type[BaseProp]], ...]
+    # Type of each unhandled property, for the statistics
+    unhandled_types: Tuple[str, ...]
+
+
+def _iter_entry_points(group: str):
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        return eps.select(group=group)
+    return eps.get(group, [])
+
+
+class PropRegistry:
+    """Registry of the handlers converting FreeCAD values of a given type.
+
+    Third-party packages can provide handlers through the ``entry_point_group``
+    entry point group, each entry point resolving to a ``BaseProp`` subclass or
+    to an iterable of them. A handler registered for an already known type
+    replaces the existing one.
+    """
+
+    def __init__(
+        self,
+        entry_point_group: Optional[str] = None,
+        dispatch_cache_size: int = DISPATCH_CACHE_SIZE,
+    ) -> None:
+        self.entry_point_group = entry_point_group
+        self.dispatch_cache_size = dispatch_cache_size
+        self._handlers: Dict[str, Type[BaseProp]] = {}
+        # Least recently used conversion plans, keyed by the object TypeId
+        # and property names (dynamic properties differ between objects)
+        self._dispatch: "OrderedDict[Tuple[str, Tuple[str, ...]], Dispatch]" = (
+            OrderedDict()
+        )
+        # Bumped whenever the handlers change
+        self._generation = 0
+        self._entry_points_loaded = False
+        self._lock = threading.Lock()
+        self._fingerprint: Optional[str] = None
+        self.unhandled: Counter = Counter()
+
+    def register(self, handler: Type[BaseProp]) -> Type[BaseProp]:
+        """Registers a handler, can be used as a class decorator"""
+        with self._lock:
+            self._handlers[handler.name()] = handler
+            self._dispatch.clear()
+            self._generation += 1
+            self._fingerprint = None
+        return handler
+
+    def register_all(self, handlers: Iterable) -> None:
+        """Registers every concrete ``BaseProp`` subclass of ``handlers``"""
+        for handler in handlers:
+            if (
+                isinstance(handler, type)
+                and issubclass(handler, BaseProp)
+                and not inspect.isabstract(handler)
+            ):
+                self.register(handler)
+
+    def load_entry_points(self) -> None:
+        """Registers the handlers provided by installed packages, only once"""
+        if self._entry_points_loaded or self.entry_point_group is None:
+            return
+        self._entry_points_loaded = True
+        for ep in _iter_entry_points(self.entry_point_group):
+            try:
+                loaded = ep.load()
+            except Exception as e:
+                logger.warning("Failed to load prop handler %s: %s", ep.name, e)
+                continue
+            self.register_all(loaded if not isinstance(loaded, type) else [loaded])
+
+    @property
+    def fingerprint(self) -> str:
+        """Changes whenever a handler is added, replaced or bumps its version"""
+        fingerprint = self._fingerprint
+        if fingerprint is None:
+            sha = hashlib.sha256()
+            for name, handler in sorted(self._handlers.items()):
+                sha.update(
+                    f"{name}={handler.__module__}.{handler.__qualname__}"
+                    f"@{handler.version};".encode()
+                )
+            fingerprint = self._fingerprint = sha.hexdigest()
+        return fingerprint
+
+    def get(self, type_id: str, default=None) -> Optional[Type[BaseProp]]:
+        return self._handlers.get(type_id, default)
+
+    def __contains__(self, type_id: str) -> bool:
+        return type_id in self._handlers
+
+    def __getitem__(self, type_id: str) -> Type[BaseProp]:
+        return self._handlers[type_id]
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def dispatch(self, obj) -> Dispatch:
+        """Returns the conversion plan of a FreeCAD object.
+
+        Plans are computed once per object ``TypeId`` and list of properties,
+        so ``getTypeIdOfProperty`` only runs for the first object of a kind.
+        """
+        properties = tuple(obj.PropertiesList)
+        key = (obj.TypeId, properties)
+        with self._lock:
+            plan = self._dispatch.get(key)
+            if plan is not None:
+                self._dispatch.move_to_end(key)
+            generation = self._generation
+        if plan is None:
+            handled = []
+            unhandled_types = []
+            for prop in properties:
+                prop_type = obj.getTypeIdOfProperty(prop)
+                handler = self._handlers.get(prop_type)
+                if handler is not None:
+                    handled.append((prop, handler))
+                else:
+                    unhandled_types.append(prop_type)
+            plan = Dispatch(properties, tuple(handled), tuple(unhandled_types))
+            with self._lock:
+                # Plans computed while a handler got registered are not kept
+                if generation == self._generation:
+                    self._dispatch[key] = plan
+                    while len(self._dispatch) > self.dispatch_cache_size:
+                        self._dispatch.popitem(last=False)
+        if plan.unhandled_types:
+            with self._lock:
+                self.unhandled.update(plan.unhandled_types)
+        return plan
+
+    def unhandled_counts(self) -> Counter:
+        """Returns a copy of the number of properties without handler, by type"""
+        with self._lock:
+            return self.unhandled.copy()
+
+    def unhandled_stats(self, n: Optional[int] = None):
+        """Returns the ``n`` most encountered property types without handler"""
+        with self._lock:
+            return self.unhandled.most_common(n)
@@ -0,0 +1,170 @@
+"""On-disk cache of converted FCStd documents, for fast reopening."""
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from typing import Dict, Optional
+
+from .. import __version__
+from .props import prop_handlers
+from .props.geometry import geom_handlers
+
+logger = logging.getLogger(__file__)
+
+# Bump when the layout of the snapshot files changes
+SNAPSHOT_FORMAT = 1
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+_MAGIC = b"JCFS"
+# magic, format version
+_HEADER = struct.Struct("<4sH")
+_SUFFIX = ".jcfs"
+
+
+class SnapshotCache:
+    """Size-bounded directory of converted document snapshots.
+
+    Snapshots are keyed by the content hash of the FCStd file, the package
+    version and the fingerprint of the registered prop handlers, so that
+    upgrading the package or changing a handler invalidates them. Each file
+    is a small header followed by zlib compressed JSON, read and decompressed
+    as a whole. The least recently used snapshots are evicted once the cache
+    grows over ``max_size`` bytes.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def _path(self, content_hash: str) -> str:
+        key = hashlib.sha256(
+            f"{content_hash}:{__version__}:{prop_handlers.fingerprint}:"
+            f"{geom_handlers.fingerprint}".encode()
+        ).hexdigest()
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, content_hash: str) -> Optional[Dict]:
+        """Returns the snapshot of a document, None if there is none"""
+        path = self._path(content_hash)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, fmt = _HEADER.unpack_from(data)
+            if magic != _MAGIC or fmt != SNAPSHOT_FORMAT:
+                raise ValueError("Unsupported snapshot format")
+            snapshot = json.loads(zlib.decompress(memoryview(data)[_HEADER.size :]))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Discarding unreadable snapshot %s: %s", path, e)
+            self._remove(path)
+            return None
+
+        # Keep track of the last use for the eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return snapshot
+
+    def put(self, content_hash: str, snapshot: Dict) -> None:
+        """Stores the snapshot of a document, then evicts old snapshots.
+
+        The cache is optional, a snapshot that cannot be encoded or written
+        is skipped.
+        """
+        try:
+            data = _HEADER.pack(_MAGIC, SNAPSHOT_FORMAT) + zlib.compress(
+                json.dumps(snapshot, separators=(",", ":")).encode()
+            )
+            if len(data) > self.max_size:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(content_hash))
+        except (TypeError, ValueError, OSError) as e:
+            logger.warning("Failed to write snapshot: %s", e)
+            return
+        self._evict()
+
+    def clear(self) -> None:
+        for entry in self._entries():
+            self._remove(entry.path)
+
+    def _entries(self):
+        try:
+            return [
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(_SUFFIX)
+            ]
+        except OSError:
+            return []
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in self._entries():
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default_cache: Optional[SnapshotCache] = None
+
+
+def get_default_cache() -> Optional[SnapshotCache]:
+    """Returns the user-wide snapshot cache.
+
+    Its location can be set with the ``JUPYTERCAD_FREECAD_SNAPSHOT_DIR``
+    environment variable, an empty value disabling it, and its size in bytes
+    with ``JUPYTERCAD_FREECAD_SNAPSHOT_MAX_SIZE``.
+    """
+    global _default_cache
+    if _default_cache is None:
+        cache_home = os.environ.get(
+            "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+        )
+        directory = os.environ.get(
+            "JUPYTERCAD_FREECAD_SNAPSHOT_DIR",
+            os.path.join(cache_home, "jupytercad_freecad", "snapshots"),
+        )
+        if not directory:
+            return None
+        max_size = os.environ.get("JUPYTERCAD_FREECAD_SNAPSHOT_MAX_SIZE")
+        try:
+            max_size = int(max_size) if max_size else DEFAULT_MAX_SIZE
+        except ValueError:
+            logger.warning(
+                "Invalid JUPYTERCAD_FREECAD_SNAPSHOT_MAX_SIZE %r, using %d bytes",
+                max_size,
+                DEFAULT_MAX_SIZE,
+            )
+            max_size = DEFAULT_MAX_SIZE
+        _default_cache = SnapshotCache(directory, max_size)
+    return _default_cache
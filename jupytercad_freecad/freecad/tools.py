@@ -1,5 +1,9 @@
+import logging
+import threading
+import time
 from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from os import devnull
+from typing import Dict, List
 
 
 @contextmanager
@@ -8,3 +12,34 @@ def redirect_stdout_stderr():
     with open(devnull, "w") as fnull:
         with redirect_stderr(fnull) as err, redirect_stdout(fnull) as out:
             yield (err, out)
+
+
+class RateLimitFilter(logging.Filter):
+    """A logging filter letting through at most ``rate`` records with the
+    same message template every ``period`` seconds"""
+
+    def __init__(self, rate: int = 10, period: float = 60.0) -> None:
+        super().__init__()
+        self.rate = rate
+        self.period = period
+        self._lock = threading.Lock()
+        # message template -> [window start, emitted, suppressed]
+        self._windows: Dict[str, List] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(record.msg)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window is not None else 0
+                self._windows[record.msg] = [now, 1, 0]
+                if suppressed:
+                    record.msg = (
+                        f"{record.msg} ({suppressed} similar messages suppressed)"
+                    )
+                return True
+            if window[1] < self.rate:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
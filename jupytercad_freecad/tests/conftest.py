@@ -0,0 +1,43 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List
+
+import pytest
+
+from jupytercad_freecad.freecad import loader
+
+from . import fake_freecad
+
+
+class CallRecorder:
+    """Records the calls of a stub, ``failing`` maps the call keys that
+    should fail to the exception they raise"""
+
+    def __init__(self) -> None:
+        self.calls: List[Any] = []
+        self.failing: Dict[Hashable, Exception] = {}
+
+    def __call__(self, key: Hashable) -> None:
+        self.calls.append(key)
+        error = self.failing.get(key)
+        if error is not None:
+            raise error
+
+
+@pytest.fixture
+def recorder():
+    return CallRecorder()
+
+
+@pytest.fixture
+def fake_freecad_modules(monkeypatch):
+    """Replaces FreeCAD by the stand-in, without simulated costs.
+
+    Returns:
+        The fake ``freecad`` and ``OfflineRenderingUtils`` modules.
+    """
+    monkeypatch.setattr(fake_freecad, "costs", fake_freecad.Costs(0, 0, 0, 0))
+    freecad, offline = fake_freecad.modules()
+    monkeypatch.setattr(loader, "fc", freecad)
+    monkeypatch.setattr(loader, "OfflineRenderingUtils", offline, raising=False)
+    monkeypatch.setattr(loader, "_guidata_cache", OrderedDict())
+    return freecad, offline
@@ -0,0 +1,286 @@
+"""A deterministic stand-in for the ``freecad`` and ``OfflineRenderingUtils``
+modules, used by the tests and by the load harness when FreeCAD is not
+available.
+
+Fake FCStd files are JSON documents holding objects whose properties are
+``{name: [type, value]}``, links being stored as object names, or
+``[name, sub-elements]`` for ``LinkSub`` properties. Opening,
+recomputing and saving them costs a configurable amount of time, either
+sleeping (releasing the GIL, like FreeCAD's C++ code mostly does) or
+spinning (holding it).
+
+This module does not import ``jupytercad_freecad``, so that it can be
+installed before it.
+"""
+
+import base64
+import json
+import sys
+import time
+import types
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+FORMAT = "fake-fcstd"
+
+BOX_PROPERTIES = {
+    "Length": "App::PropertyLength",
+    "Width": "App::PropertyLength",
+    "Height": "App::PropertyLength",
+    "Label": "App::PropertyString",
+}
+
+
+LINK_TYPES = {
+    "App::PropertyLink",
+    "App::PropertyLinkList",
+    "App::PropertyLinkSub",
+    "App::PropertyLinkSubList",
+}
+
+
+@dataclass
+class Costs:
+    """Simulated costs, in seconds"""
+
+    open: float = 0.02
+    open_per_object: float = 0.0002
+    recompute: float = 0.01
+    recompute_per_object: float = 0.0002
+    spin: bool = False
+
+
+costs = Costs()
+
+
+def _spend(seconds: float) -> None:
+    if seconds <= 0:
+        return
+    if not costs.spin:
+        time.sleep(seconds)
+        return
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class Quantity:
+    def __init__(self, value: float) -> None:
+        self.Value = value
+
+
+def _name(obj) -> Optional[str]:
+    return obj.Name if obj is not None else None
+
+
+class FakeObject:
+    def __init__(
+        self,
+        name: str,
+        type_id: str,
+        props: Dict,
+        visible: bool = True,
+        doc: Optional["FakeDocument"] = None,
+    ) -> None:
+        self.__dict__.update(Name=name, TypeId=type_id, Visibility=visible)
+        self.__dict__["_props"] = dict(props)
+        self.__dict__["_doc"] = doc
+
+    @property
+    def PropertiesList(self) -> List[str]:
+        return list(self._props)
+
+    @property
+    def OutList(self) -> List["FakeObject"]:
+        """The objects this one links to"""
+        out = []
+        for prop, (prop_type, _) in self._props.items():
+            if prop_type not in LINK_TYPES:
+                continue
+            value = getattr(self, prop)
+            if prop_type == "App::PropertyLink":
+                value = [value]
+            elif prop_type == "App::PropertyLinkSub":
+                value = [value[0]] if value else []
+            elif prop_type == "App::PropertyLinkSubList":
+                value = [obj for obj, _ in value]
+            out.extend(obj for obj in value if obj is not None)
+        return out
+
+    def getTypeIdOfProperty(self, prop: str) -> str:
+        return self._props[prop][0]
+
+    def __getattr__(self, prop: str):
+        try:
+            prop_type, value = self.__dict__["_props"][prop]
+        except KeyError:
+            raise AttributeError(prop) from None
+        if prop_type == "App::PropertyLength":
+            return Quantity(value)
+        if prop_type == "App::PropertyLink":
+            return self._doc.getObject(value) if value is not None else None
+        if prop_type == "App::PropertyLinkList":
+            return [self._doc.getObject(name) for name in value]
+        if prop_type == "App::PropertyLinkSub":
+            return (self._doc.getObject(value[0]), value[1]) if value else None
+        if prop_type == "App::PropertyLinkSubList":
+            return [(self._doc.getObject(name), subs) for name, subs in value]
+        return value
+
+    def __setattr__(self, prop: str, value) -> None:
+        if prop in self.__dict__:
+            self.__dict__[prop] = value
+            return
+        if prop not in self._props:
+            raise AttributeError(prop)
+        prop_type = self._props[prop][0]
+        if isinstance(value, Quantity):
+            value = value.Value
+        elif prop_type == "App::PropertyLink":
+            value = _name(value)
+        elif prop_type == "App::PropertyLinkList":
+            value = [_name(obj) for obj in value]
+        self._props[prop] = (prop_type, value)
+
+
+class FakeDocument:
+    def __init__(self, path: str, data: Dict) -> None:
+        self.Name = f"Doc{id(self)}"
+        self.FileName = path
+        self.Meta = data["meta"]
+        self._objects: Dict[str, FakeObject] = {}
+        for obj in data["objects"]:
+            self._objects[obj["name"]] = FakeObject(
+                obj["name"],
+                obj["type"],
+                {k: tuple(v) for k, v in obj["props"].items()},
+                obj.get("visible", True),
+                self,
+            )
+
+    @property
+    def Objects(self) -> List[FakeObject]:
+        return list(self._objects.values())
+
+    def getObject(self, name: str) -> Optional[FakeObject]:
+        return self._objects.get(name)
+
+    def addObject(self, type_id: str, name: str) -> FakeObject:
+        props = BOX_PROPERTIES if type_id == "Part::Box" else {}
+        obj = FakeObject(
+            name,
+            type_id,
+            {k: (t, 1.0 if "Length" in t else name) for k, t in props.items()},
+            doc=self,
+        )
+        self._objects[name] = obj
+        return obj
+
+    def removeObject(self, name: str) -> None:
+        del self._objects[name]
+
+    def recompute(self) -> None:
+        _spend(costs.recompute + costs.recompute_per_object * len(self._objects))
+
+    def to_dict(self, guidata: Dict) -> Dict:
+        return dict(
+            format=FORMAT,
+            meta=self.Meta,
+            guidata=guidata,
+            objects=[
+                dict(
+                    name=obj.Name,
+                    type=obj.TypeId,
+                    visible=obj.Visibility,
+                    props=obj._props,
+                )
+                for obj in self._objects.values()
+            ],
+        )
+
+
+def _read(path: str) -> Dict:
+    with open(path, "rb") as f:
+        data = json.loads(f.read())
+    if data.get("format") != FORMAT:
+        raise ValueError(f"{path} is not a fake FCStd file")
+    return data
+
+
+def openDocument(path: str) -> FakeDocument:
+    data = _read(path)
+    _spend(costs.open + costs.open_per_object * len(data["objects"]))
+    return FakeDocument(path, data)
+
+
+def closeDocument(name: str) -> None:
+    pass
+
+
+def getGuiData(path: str) -> Dict:
+    return _read(path)["guidata"]
+
+
+def save(doc: FakeDocument, guidata: Optional[Dict] = None, **kwargs) -> None:
+    with open(doc.FileName, "w") as f:
+        json.dump(doc.to_dict(guidata or {}), f)
+
+
+def make_file(
+    objects: List[Dict], guidata: Optional[Dict] = None, meta: Optional[Dict] = None
+) -> bytes:
+    """Returns the content of a fake FCStd file.
+
+    ``objects`` are ``dict(name=..., type=..., props={name: [type, value]})``
+    with an optional ``visible``.
+    """
+    return json.dumps(
+        dict(format=FORMAT, meta=meta or {}, guidata=guidata or {}, objects=objects)
+    ).encode()
+
+
+def make_sources(objects: List[Dict], guidata: Optional[Dict] = None) -> str:
+    """Returns a base64 encoded fake FCStd file, like the YFCStd sources"""
+    return base64.b64encode(make_file(objects, guidata)).decode()
+
+
+def read_sources(sources: str) -> Dict:
+    """Returns the data of a base64 encoded fake FCStd file"""
+    return json.loads(base64.b64decode(sources))
+
+
+def make_document(n_objects: int, seed: int = 0) -> bytes:
+    """Returns the content of a fake FCStd file holding ``n_objects`` boxes"""
+    objects = []
+    guidata = {}
+    for i in range(n_objects):
+        name = f"Box{i:04d}"
+        size = 1.0 + (seed * 31 + i * 7) % 10
+        props = {k: [t, size] for k, t in BOX_PROPERTIES.items() if "Length" in t}
+        props["Label"] = ["App::PropertyString", name]
+        objects.append(dict(name=name, type="Part::Box", visible=True, props=props))
+        guidata[name] = {
+            "ShapeColor": {"type": "App::PropertyColor", "value": [0.8, 0.8, 0.8]},
+            "Visibility": {"type": "App::PropertyBool", "value": True},
+        }
+    return make_file(objects, guidata)
+
+
+def modules() -> Tuple[types.ModuleType, types.ModuleType]:
+    """Returns the fake ``freecad`` and ``OfflineRenderingUtils`` modules"""
+    freecad = types.ModuleType("freecad")
+    freecad.app = types.SimpleNamespace(
+        openDocument=openDocument,
+        closeDocument=closeDocument,
+    )
+    offline = types.ModuleType("OfflineRenderingUtils")
+    offline.getGuiData = getGuiData
+    offline.save = save
+    return freecad, offline
+
+
+def install() -> None:
+    """Registers the fake modules, must run before jupytercad_freecad is imported"""
+    freecad, offline = modules()
+    sys.modules["freecad"] = freecad
+    sys.modules["OfflineRenderingUtils"] = offline
@@ -0,0 +1,103 @@
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from jupytercad_freecad.freecad import convert
+
+
+@pytest.fixture
+def converted(monkeypatch, recorder):
+    """Replaces the FreeCAD conversion by a stub recording the converted files,
+    failing or crashing the worker for the file names in ``recorder.failing``"""
+
+    def _convert_file(source, destination, sidecar, roots=None, types=None):
+        recorder(os.path.basename(source))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination, "w") as f:
+            json.dump({"objects": []}, f)
+        return 1, 0, None, Counter()
+
+    monkeypatch.setattr(convert, "_convert_file", _convert_file)
+    monkeypatch.setattr(convert, "ProcessPoolExecutor", ThreadPoolExecutor)
+    return recorder
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    source = tmp_path / "source"
+    (source / "sub").mkdir(parents=True)
+    (source / "a.FCStd").write_bytes(b"a")
+    (source / "sub" / "b.FCStd").write_bytes(b"b")
+    (source / "notes.txt").write_text("not a FreeCAD file")
+    return str(source)
+
+
+def _run(source_dir, output_dir, **kwargs):
+    with open(os.devnull, "w") as out:
+        return convert.convert_tree(source_dir, output_dir, out=out, **kwargs)
+
+
+def _manifest(output_dir):
+    with open(os.path.join(output_dir, convert.MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def test_unchanged_files_are_skipped(converted, source_dir, tmp_path):
+    calls = converted.calls
+    output = str(tmp_path / "out")
+
+    assert _run(source_dir, output) == 0
+    assert sorted(calls) == ["a.FCStd", "b.FCStd"]
+    assert os.path.exists(os.path.join(output, "sub", "b.jcad"))
+    assert sorted(_manifest(output)) == ["a.FCStd", os.path.join("sub", "b.FCStd")]
+
+    calls.clear()
+    assert _run(source_dir, output) == 0
+    assert calls == []
+
+    with open(os.path.join(source_dir, "a.FCStd"), "wb") as f:
+        f.write(b"changed")
+    assert _run(source_dir, output) == 0
+    assert calls == ["a.FCStd"]
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [dict(force=True), dict(sidecar="brep"), dict(roots=["Box"]), dict(types=["X"])],
+)
+def test_options_convert_again(converted, source_dir, tmp_path, kwargs):
+    calls = converted.calls
+    output = str(tmp_path / "out")
+    _run(source_dir, output)
+
+    calls.clear()
+    _run(source_dir, output, **kwargs)
+    assert sorted(calls) == ["a.FCStd", "b.FCStd"]
+
+
+def test_failed_file_is_dropped_from_manifest(converted, source_dir, tmp_path):
+    calls, failing = converted.calls, converted.failing
+    output = str(tmp_path / "out")
+    _run(source_dir, output)
+
+    failing["a.FCStd"] = ValueError("broken file")
+    assert _run(source_dir, output, force=True) == 1
+    assert list(_manifest(output)) == [os.path.join("sub", "b.FCStd")]
+
+    # The failed file is converted again on the next run
+    calls.clear()
+    failing.clear()
+    assert _run(source_dir, output) == 0
+    assert calls == ["a.FCStd"]
+
+
+def test_crashed_worker_only_fails_its_file(converted, source_dir, tmp_path):
+    output = str(tmp_path / "out")
+    converted.failing["a.FCStd"] = BrokenProcessPool("worker died")
+
+    assert _run(source_dir, output) == 1
+    assert list(_manifest(output)) == [os.path.join("sub", "b.FCStd")]
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from pycrdt import Map
+
+from jupytercad_freecad import fcstd_ydoc
+from jupytercad_freecad.fcstd_ydoc import YFCStd
+from jupytercad_freecad.freecad.loader import FCStd, ConversionReport, freecad_lock
+
+from .fake_freecad import make_sources
+
+DEBOUNCE = 0.05
+EMPTY = make_sources([])
+
+
+@pytest.fixture
+def saves(monkeypatch, recorder, fake_freecad_modules):
+    """Loads with the FreeCAD stand-in, and replaces the save by a stub
+    recording the number of saved objects, the saves of a number of objects
+    in ``recorder.failing`` fail"""
+
+    def save(self, objects, options, metadata):
+        time.sleep(0.01)
+        report = ConversionReport()
+        try:
+            recorder(len(objects))
+        except Exception as e:
+            report.add("save", e)
+            report.fatal = True
+        else:
+            self._sources = f"sources-{len(objects)}"
+        return report
+
+    monkeypatch.setattr(FCStd, "save", save)
+    monkeypatch.setattr(fcstd_ydoc, "get_default_cache", lambda: None)
+    return recorder
+
+
+def _add_box(doc, idx):
+    doc.objects.append(
+        Map(dict(name=f"Box{idx}", shape="Part::Box", visible=True, parameters=dict()))
+    )
+
+
+async def _settle(doc):
+    """Waits until no save is scheduled or running"""
+    while doc._handle is not None or doc._saving is not None:
+        await asyncio.sleep(DEBOUNCE / 5)
+
+
+def test_saves_are_coalesced(saves):
+    calls = saves.calls
+    n_edits = 50
+
+    async def run():
+        doc = YFCStd(save_debounce=DEBOUNCE)
+        doc.set(EMPTY)
+        start = time.monotonic()
+        for idx in range(n_edits):
+            _add_box(doc, idx)
+            # The save is left to the FreeCAD worker
+            assert doc.get() in (EMPTY, f"sources-{calls[-1] if calls else 0}")
+            await asyncio.sleep(0.002)
+        await _settle(doc)
+        elapsed = time.monotonic() - start
+        return doc, elapsed
+
+    doc, elapsed = asyncio.run(run())
+    assert 1 <= len(calls) <= elapsed / DEBOUNCE + 2
+    assert doc.save_count == len(calls)
+    # The last save received the final state
+    assert calls[-1] == n_edits
+    assert doc.get() == f"sources-{n_edits}"
+    assert doc.dirty
+
+
+def test_failed_save_is_retried(saves):
+    calls = saves.calls
+    saves.failing[1] = RuntimeError("FreeCAD crashed")
+
+    async def run():
+        doc = YFCStd(save_debounce=DEBOUNCE)
+        doc.set(EMPTY)
+        _add_box(doc, 0)
+        assert doc.get() == EMPTY
+        await _settle(doc)
+        assert calls == [1]
+        assert doc.save_count == 0
+        assert not doc.dirty
+
+        # The snapshot was not marked as saved, so it is saved again
+        saves.failing.clear()
+        assert doc.get() == EMPTY
+        await _settle(doc)
+        return doc
+
+    doc = asyncio.run(run())
+    assert calls == [1, 1]
+    assert doc.save_count == 1
+    assert doc.get() == "sources-1"
+
+
+def test_set_discards_pending_save(saves):
+    calls = saves.calls
+
+    async def run():
+        doc = YFCStd(save_debounce=DEBOUNCE)
+        doc.set(EMPTY)
+        _add_box(doc, 0)
+        doc.get()
+        doc.set(EMPTY)
+        await asyncio.sleep(DEBOUNCE * 2)
+        return doc
+
+    doc = asyncio.run(run())
+    assert calls == []
+    assert doc.save_count == 0
+
+
+def test_get_without_event_loop_saves_right_away(saves):
+    calls = saves.calls
+    doc = YFCStd(save_debounce=DEBOUNCE)
+    doc.set(EMPTY)
+    _add_box(doc, 0)
+    assert doc.get() == "sources-1"
+    assert calls == [1]
+    # Nothing changed since the last save
+    assert doc.get() == "sources-1"
+    assert calls == [1]
+
+
+def test_start_save_does_not_wait_for_freecad(saves):
+    doc = YFCStd(save_debounce=DEBOUNCE)
+    doc.set(EMPTY)
+    _add_box(doc, 0)
+    doc._pending = doc._snapshot()
+
+    # Another document is loading or saving
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with freecad_lock:
+            locked.set()
+            release.wait(timeout=1)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    locked.wait()
+    try:
+        start = time.monotonic()
+        doc._start_save()
+        assert time.monotonic() - start < 0.1
+        assert not doc._saving.done()
+    finally:
+        release.set()
+        holder.join()
+
+    doc._saving.result(timeout=5)
+    assert saves.calls == [1]
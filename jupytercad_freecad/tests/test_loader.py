@@ -0,0 +1,162 @@
+import pytest
+
+from jupytercad_freecad.freecad.loader import MAX_REPORTED_ERRORS, FCStd
+
+from .fake_freecad import make_sources, read_sources
+
+
+def _box(name, solid=True):
+    return dict(
+        name=name, type="Part::Box", props=dict(Solid=["App::PropertyBool", solid])
+    )
+
+
+def _linked(name, type_id, **links):
+    return dict(name=name, type=type_id, props=links)
+
+
+# Fusion -> Cut -> BoxA, BoxB and Pad -> Sketch, next to an unrelated box
+LINKED_OBJECTS = [
+    _box("BoxA"),
+    _box("BoxB"),
+    _box("Other"),
+    _linked(
+        "Cut",
+        "Part::Cut",
+        Base=["App::PropertyLink", "BoxA"],
+        Tool=["App::PropertyLink", "BoxB"],
+    ),
+    _linked("Fusion", "Part::MultiFuse", Shapes=["App::PropertyLinkList", ["Cut"]]),
+    _linked("Sketch", "Sketcher::SketchObject"),
+    _linked("Pad", "PartDesign::Pad", Profile=["App::PropertyLinkSub", ["Sketch", []]]),
+]
+
+
+@pytest.mark.parametrize(
+    "kwargs, loaded",
+    [
+        (dict(roots=["Fusion"]), ["BoxA", "BoxB", "Cut", "Fusion"]),
+        (dict(roots=["Cut"]), ["BoxA", "BoxB", "Cut"]),
+        (dict(type_filter="PartDesign::Pad".__eq__), ["Sketch", "Pad"]),
+    ],
+)
+def test_partial_load_follows_links(fake_freecad_modules, kwargs, loaded):
+    fc_file = FCStd()
+    report = fc_file.load(make_sources(LINKED_OBJECTS), **kwargs)
+    assert len(report) == 0
+    assert [obj["name"] for obj in fc_file.objects] == loaded
+
+    # Removing a loaded object keeps the objects that were left out
+    removed = loaded[-1]
+    objects = [obj for obj in fc_file.objects if obj["name"] != removed]
+    report = fc_file.save(objects, {}, {})
+
+    assert len(report) == 0
+    saved = [obj["name"] for obj in read_sources(fc_file.sources)["objects"]]
+    assert saved == [obj["name"] for obj in LINKED_OBJECTS if obj["name"] != removed]
+    assert fc_file._loaded_names == set(loaded) - {removed}
+
+
+def test_partial_load_rejects_clashing_names(fake_freecad_modules):
+    fc_file = FCStd()
+    fc_file.load(make_sources([_box("Box"), _box("Hidden", False)]), roots=["Box"])
+    assert [obj["name"] for obj in fc_file.objects] == ["Box"]
+
+    new_obj = dict(
+        name="Hidden",
+        shape="Part::Cylinder",
+        visible=True,
+        parameters=dict(Solid=True),
+    )
+    report = fc_file.save(fc_file.objects + [new_obj], {}, {})
+
+    assert [(e["stage"], e["object"]) for e in report.errors] == [("add", "Hidden")]
+    saved = {obj["name"]: obj for obj in read_sources(fc_file.sources)["objects"]}
+    assert saved["Hidden"]["type"] == "Part::Box"
+    assert saved["Hidden"]["props"] == _box("Hidden", False)["props"]
+
+
+def test_unconvertible_properties_are_bounded(fake_freecad_modules, capsys):
+    n_props = MAX_REPORTED_ERRORS + 50
+    # Placements are expected to be FreeCAD placements, floats fail to convert
+    props = {f"Placement{i}": ["App::PropertyPlacement", 1.0] for i in range(n_props)}
+    fc_file = FCStd()
+    report = fc_file.load(
+        make_sources([dict(name="Box", type="Part::Box", props=props)])
+    )
+
+    assert capsys.readouterr().out == ""
+    assert len(report.errors) == MAX_REPORTED_ERRORS
+    assert report.dropped == n_props - MAX_REPORTED_ERRORS
+    assert len(report) == n_props
+    assert fc_file.objects[0]["parameters"]["Placement0"] is None
+
+
+def test_failed_save_keeps_state(fake_freecad_modules):
+    fc_file = FCStd()
+    fc_file.load(
+        make_sources([_box("Box"), _box("Other"), _box("Hidden")]),
+        roots=["Box", "Other"],
+    )
+    sources = fc_file.sources
+    guidata = dict(fc_file._guidata)
+
+    def save(doc, guidata=None):
+        raise RuntimeError("disk full")
+
+    _, offline = fake_freecad_modules
+    offline.save = save
+    box = dict(fc_file.objects[0], parameters=dict(Color="#ff0000", Solid=True))
+    report = fc_file.save([box], {}, {})
+
+    assert report.fatal
+    assert fc_file.sources == sources
+    assert fc_file._loaded_names == {"Box", "Other"}
+    assert fc_file._guidata == guidata
+    assert fc_file._fc_guidata == {}
+
+
+def _guidata(rgb):
+    return dict(
+        ShapeColor=dict(type="App::PropertyColor", value=rgb),
+        Visibility=dict(type="App::PropertyBool", value=True),
+        DisplayMode=dict(type="App::PropertyEnumeration", value="Shaded"),
+    )
+
+
+# Not representable as hex colors, these change if they are regenerated
+GUIDATA = dict(A=_guidata([0.1, 0.1, 0.1]), B=_guidata([0.3, 0.3, 0.3]))
+
+
+def test_guidata_is_parsed_once_per_archive(fake_freecad_modules, recorder):
+    _, offline = fake_freecad_modules
+    get_guidata = offline.getGuiData
+
+    def getGuiData(path):
+        recorder(path)
+        return get_guidata(path)
+
+    offline.getGuiData = getGuiData
+    sources = make_sources([_box("A"), _box("B")], GUIDATA)
+    FCStd().load(sources)
+    fc_file = FCStd()
+    fc_file.load(sources)
+
+    assert len(recorder.calls) == 1
+    assert fc_file.objects[0]["parameters"]["Color"] == "#191919"
+
+
+def test_save_only_patches_changed_guidata(fake_freecad_modules):
+    fc_file = FCStd()
+    fc_file.load(make_sources([_box("A"), _box("B")], GUIDATA))
+
+    a, b = fc_file.objects
+    a = dict(a, parameters=dict(a["parameters"], Color="#ff0000"))
+    report = fc_file.save([a, b], {}, {})
+
+    assert len(report) == 0
+    guidata = read_sources(fc_file.sources)["guidata"]
+    assert guidata["B"] == GUIDATA["B"]
+    assert guidata["A"]["ShapeColor"]["value"] == [1.0, 0.0, 0.0]
+    # Keys JupyterCAD does not map survive the save
+    assert guidata["A"]["DisplayMode"] == GUIDATA["A"]["DisplayMode"]
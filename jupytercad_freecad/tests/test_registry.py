@@ -0,0 +1,82 @@
+from jupytercad_freecad.freecad.loader import ConversionReport, FCStd
+from jupytercad_freecad.freecad.props.base_prop import BaseProp
+from jupytercad_freecad.freecad.props.registry import PropRegistry
+
+from .fake_freecad import FakeObject
+
+
+class Double(BaseProp):
+    @staticmethod
+    def name() -> str:
+        return "Test::Double"
+
+    @staticmethod
+    def fc_to_jcad(prop_value, **kwargs):
+        return prop_value * 2
+
+    @staticmethod
+    def jcad_to_fc(prop_value, **kwargs):
+        return prop_value / 2
+
+
+class RecordingObject(FakeObject):
+    """Fake FreeCAD object recording which of its properties are read"""
+
+    def __init__(self, name, props, type_id="Test::Object"):
+        super().__init__(name, type_id, props)
+        self.__dict__["read"] = []
+
+    def __getattr__(self, prop):
+        value = super().__getattr__(prop)
+        self.read.append(prop)
+        return value
+
+
+def _registry(**kwargs):
+    registry = PropRegistry(**kwargs)
+    registry.register(Double)
+    return registry
+
+
+def test_unhandled_properties_are_never_read():
+    fc_file = FCStd()
+    fc_file._prop_handlers = _registry()
+    obj = RecordingObject(
+        "Obj",
+        dict(
+            Size=["Test::Double", 2],
+            Shape=["Part::PropertyPartShape", "expensive"],
+            Data=["App::PropertyPythonObject", "expensive"],
+        ),
+    )
+
+    obj_data = fc_file._fc_to_jcad_obj(obj, ConversionReport())
+
+    assert obj.read == ["Size"]
+    assert obj_data["parameters"] == dict(Size=4, Shape=None, Data=None)
+    assert fc_file._prop_handlers.unhandled_counts() == {
+        "Part::PropertyPartShape": 1,
+        "App::PropertyPythonObject": 1,
+    }
+
+
+def test_dispatch_cache_is_bounded():
+    registry = _registry(dispatch_cache_size=2)
+    objects = [
+        RecordingObject(f"Obj{i}", {f"Dynamic{i}": ["Test::Double", i]})
+        for i in range(5)
+    ]
+    plans = [registry.dispatch(obj) for obj in objects]
+
+    assert len(registry._dispatch) == 2
+    assert registry.dispatch(objects[-1]) is plans[-1]
+    assert registry.dispatch(objects[0]) is not plans[0]
+
+
+def test_register_invalidates_dispatch():
+    registry = PropRegistry()
+    obj = RecordingObject("Obj", dict(Size=["Test::Double", 2]))
+    assert registry.dispatch(obj).handled == ()
+
+    registry.register(Double)
+    assert registry.dispatch(obj).handled == (("Size", Double),)
@@ -0,0 +1,102 @@
+import logging
+import os
+
+import pytest
+
+from jupytercad_freecad.freecad import snapshot
+from jupytercad_freecad.freecad.props.base_prop import BaseProp
+from jupytercad_freecad.freecad.props.registry import PropRegistry
+from jupytercad_freecad.freecad.snapshot import DEFAULT_MAX_SIZE, SnapshotCache
+
+SNAPSHOT = dict(
+    objects=[dict(name="Box", shape="Part::Box", parameters=dict(Length=1.0))],
+    metadata={},
+    guidata={},
+    loaded_names=None,
+    report=dict(errors=[], dropped=0),
+)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SnapshotCache(str(tmp_path / "snapshots"))
+
+
+def _entries(cache):
+    return sorted(entry.name for entry in cache._entries())
+
+
+def test_round_trip(cache):
+    assert cache.get("a") is None
+    cache.put("a", SNAPSHOT)
+    assert cache.get("a") == SNAPSHOT
+    assert cache.get("b") is None
+
+
+def test_unencodable_snapshot_is_skipped(cache, caplog):
+    # e.g. a value returned by a third-party prop handler
+    snapshot = dict(SNAPSHOT, metadata=dict(Created=object()))
+    with caplog.at_level(logging.WARNING):
+        cache.put("a", snapshot)
+
+    assert "Failed to write snapshot" in caplog.text
+    assert cache.get("a") is None
+    assert _entries(cache) == []
+
+
+def test_unreadable_snapshot_is_discarded(cache):
+    cache.put("a", SNAPSHOT)
+    with open(cache._path("a"), "wb") as f:
+        f.write(b"garbage")
+    assert cache.get("a") is None
+    assert _entries(cache) == []
+
+
+def test_least_recently_used_is_evicted(cache):
+    cache.put("a", SNAPSHOT)
+    size = os.path.getsize(cache._path("a"))
+    cache.max_size = 2 * size
+    cache.put("b", SNAPSHOT)
+    # "a" was used more recently than "b"
+    os.utime(cache._path("a"), (1, 1))
+    os.utime(cache._path("b"), (0, 0))
+    cache.get("a")
+
+    cache.put("c", SNAPSHOT)
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+def test_registering_a_handler_invalidates(cache, monkeypatch):
+    registry = PropRegistry()
+    monkeypatch.setattr(snapshot, "prop_handlers", registry)
+    cache.put("a", SNAPSHOT)
+
+    @registry.register
+    class Handler(BaseProp):
+        @staticmethod
+        def name() -> str:
+            return "Test::Handler"
+
+        @staticmethod
+        def fc_to_jcad(prop_value, **kwargs):
+            return prop_value
+
+        @staticmethod
+        def jcad_to_fc(prop_value, **kwargs):
+            return prop_value
+
+    assert cache.get("a") is None
+
+
+def test_invalid_max_size_falls_back_to_default(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(snapshot, "_default_cache", None)
+    monkeypatch.setenv("JUPYTERCAD_FREECAD_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setenv("JUPYTERCAD_FREECAD_SNAPSHOT_MAX_SIZE", "1GB")
+
+    with caplog.at_level(logging.WARNING):
+        cache = snapshot.get_default_cache()
+
+    assert cache.max_size == DEFAULT_MAX_SIZE
+    assert "JUPYTERCAD_FREECAD_SNAPSHOT_MAX_SIZE" in caplog.text